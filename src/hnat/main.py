@@ -16,14 +16,14 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from builtins import object
 from qgis.core import QgsApplication
 from .processing import HabitatConnectivityToolProcessingProvider
 
-class HabitatConnectivityToolPlugin(object):
+class HabitatConnectivityToolPlugin:
 
 	def __init__(self, iface):
 		self.iface = iface  # Save reference to the QGIS interface
+		self._processingProvider = None
 
 	def initGui(self):
 		self.initProcessing()
@@ -0,0 +1,289 @@
+"""
+Habitat Network Analysis Tool
+Copyright (C) 2023  Martin Fitger, Oskar Kindvall, Ioanna Stavroulaki, Meta Berghauser Pont
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import math
+import numpy as np
+from osgeo import gdal
+from .utils import CreateRaster, OpenRaster, RasterChunks, ValidMask
+try:
+	from numba import njit
+except ImportError:
+	njit = None
+
+# The in-process cost-distance needs numba, a pure Python Dijkstra would be
+# far slower than GRASS r.cost which is used otherwise.
+AVAILABLE = njit is not None
+
+COST_DISTANCE_NODATA = -1
+
+# Rasters wider or taller than this are processed in tiles of this size
+TILE_SIZE = 4096
+
+# Tiling is only used if the tile windows, halos included, add up to at most
+# this many times the raster area. Beyond that the halos make every tile
+# redo most of the search, and a single window is both faster and no larger.
+MAX_TILED_AREA_FACTOR = 2
+
+
+def _HeapPush(keys, items, size, key, item):
+	i = size
+	while i > 0:
+		parent = (i - 1) >> 1
+		if keys[parent] <= key:
+			break
+		keys[i] = keys[parent]
+		items[i] = items[parent]
+		i = parent
+	keys[i] = key
+	items[i] = item
+	return size + 1
+
+
+def _HeapPop(keys, items, size):
+	key = keys[0]
+	item = items[0]
+	size -= 1
+	last_key = keys[size]
+	last_item = items[size]
+	i = 0
+	while True:
+		child = 2 * i + 1
+		if child >= size:
+			break
+		if child + 1 < size and keys[child + 1] < keys[child]:
+			child += 1
+		if keys[child] >= last_key:
+			break
+		keys[i] = keys[child]
+		items[i] = items[child]
+		i = child
+	keys[i] = last_key
+	items[i] = last_item
+	return key, item, size
+
+
+def _GrowHeap(keys, items, size):
+	keys = np.concatenate((keys, np.empty(max(size, 1024), dtype=keys.dtype)))
+	items = np.concatenate((items, np.empty(max(size, 1024), dtype=items.dtype)))
+	return keys, items
+
+
+def _CostDistanceKernel(friction, sources, cols, ew_res, ns_res, max_cost, nodata, dist, visited, keys, items):
+	"""
+	Multi-source Dijkstra over the 8-connected pixel grid (flattened, 'cols'
+	pixels per row). Moving between two pixels costs the mean of their
+	friction times the distance in map units, like GRASS r.cost. Pixels with
+	negative friction are barriers. The search never goes beyond max_cost, so
+	dist receives the accumulated cost already clamped, and nodata where it
+	exceeds max_cost or is unreachable. visited, keys and items are scratch
+	buffers; the heap arrays are grown when needed and returned.
+	"""
+	n = friction.size
+	dist.fill(np.inf)
+	visited.fill(False)
+	size = 0
+
+	for i in range(n):
+		if sources[i] and friction[i] >= 0:
+			dist[i] = 0.0
+			if size == keys.size:
+				keys, items = _GrowHeap(keys, items, size)
+			size = _HeapPush(keys, items, size, 0.0, i)
+
+	diag_res = math.sqrt(ew_res * ew_res + ns_res * ns_res)
+	d_rows = (-1, -1, -1, 0, 0, 1, 1, 1)
+	d_cols = (-1, 0, 1, -1, 1, -1, 0, 1)
+	steps = np.array((diag_res, ns_res, diag_res, ew_res, ew_res, diag_res, ns_res, diag_res), dtype=np.float32)
+	rows = n // cols
+
+	while size > 0:
+		_, i, size = _HeapPop(keys, items, size)
+		if visited[i]:
+			continue
+		visited[i] = True
+		d = dist[i]
+		row = i // cols
+		col = i - row * cols
+		f = friction[i]
+		for k in range(8):
+			r = row + d_rows[k]
+			c = col + d_cols[k]
+			if r < 0 or r >= rows or c < 0 or c >= cols:
+				continue
+			j = r * cols + c
+			if visited[j]:
+				continue
+			fj = friction[j]
+			if not fj >= 0:
+				continue
+			cost = d + np.float32(0.5) * (f + fj) * steps[k]
+			if cost > max_cost or cost >= dist[j]:
+				continue
+			dist[j] = cost
+			if size == keys.size:
+				keys, items = _GrowHeap(keys, items, size)
+			size = _HeapPush(keys, items, size, cost, j)
+
+	for i in range(n):
+		if not visited[i]:
+			dist[i] = nodata
+
+	return keys, items
+
+
+if njit is not None:
+	_HeapPush = njit(cache=True)(_HeapPush)
+	_HeapPop = njit(cache=True)(_HeapPop)
+	_GrowHeap = njit(cache=True)(_GrowHeap)
+	_CostDistanceKernel = njit(cache=True)(_CostDistanceKernel)
+
+
+class CostDistanceScratch:
+	"""
+	Working buffers of the cost-distance kernel, kept between calls so that
+	running several parameter sets (or tiles) over the same raster allocates
+	them once. The buffers only ever grow.
+	"""
+
+	def __init__(self):
+		self.dist = None
+		self.visited = None
+		self.keys = None
+		self.items = None
+
+	def reserve(self, size, heap_size):
+		if self.dist is None or self.dist.size < size:
+			self.dist = np.empty(size, dtype=np.float32)
+			self.visited = np.empty(size, dtype=np.bool_)
+		if self.keys is None or self.keys.size < heap_size:
+			self.keys = np.empty(heap_size, dtype=np.float32)
+			self.items = np.empty(heap_size, dtype=np.int64)
+
+
+def _EstimateHeapSize(friction, source_count, cellsize, max_cost):
+	# The search front around a source is bounded by max_cost / (min friction
+	# * cellsize) pixels, so the heap rarely holds more than that disc.
+	positive = friction[friction > 0]
+	if positive.size == 0:
+		return max(1024, source_count)
+	radius = max_cost / (float(positive.min()) * cellsize)
+	return int(min(friction.size, max(1024, source_count + math.pi * radius * radius)))
+
+
+def _CostDistanceWindow(source_band, friction_band, xoff, yoff, xsize, ysize, ew_res, ns_res, max_cost, scratch):
+	sources = source_band.ReadAsArray(xoff, yoff, xsize, ysize)
+	sources = ValidMask(sources, source_band.GetNoDataValue()) & (sources != 0)
+	friction = friction_band.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float32, copy=False)
+	friction[~ValidMask(friction, friction_band.GetNoDataValue())] = -1
+
+	n = friction.size
+	scratch.reserve(n, _EstimateHeapSize(friction, int(np.count_nonzero(sources)), min(ew_res, ns_res), max_cost))
+	scratch.keys, scratch.items = _CostDistanceKernel(friction.ravel(), sources.ravel(), xsize, ew_res, ns_res, float(max_cost), COST_DISTANCE_NODATA, scratch.dist[:n], scratch.visited[:n], scratch.keys, scratch.items)
+	return scratch.dist[:n].reshape(friction.shape)
+
+
+def _TileWindows(xsize, ysize, depth):
+	"""
+	Yields (core, window) pairs of (xoff, yoff, xsize, ysize) tuples, where
+	core tiles cover the raster and each window extends its core by depth
+	pixels on every side, clipped to the raster.
+	"""
+	for yoff in range(0, ysize, TILE_SIZE):
+		for xoff in range(0, xsize, TILE_SIZE):
+			core = (xoff, yoff, min(TILE_SIZE, xsize - xoff), min(TILE_SIZE, ysize - yoff))
+			x0 = max(0, xoff - depth)
+			y0 = max(0, yoff - depth)
+			x1 = min(xsize, xoff + core[2] + depth)
+			y1 = min(ysize, yoff + core[3] + depth)
+			yield core, (x0, y0, x1 - x0, y1 - y0)
+
+
+def CreateCostDistanceRaster(source_path, friction_path, max_cost, output_path, scratch=None):
+	"""
+	Writes the accumulated cost-distance (in friction * map units) from the
+	source pixels of source_path over the friction raster, up to max_cost,
+	as a Float32 GeoTIFF with nodata -1 beyond max_cost. Pass the same
+	CostDistanceScratch to consecutive calls to reuse its buffers.
+
+	Large rasters are processed in tiles when all passable pixels have a
+	positive friction. A path of cost max_cost then spans at most
+	max_cost / (min friction * cellsize) pixels, so running the search on
+	each tile extended by that many pixels gives the exact result. This is
+	only done when that halo is small compared to the tiles (see
+	MAX_TILED_AREA_FACTOR); memory is then bounded by the largest window
+	rather than the raster.
+	"""
+	source_ds = OpenRaster(source_path)
+	friction_ds = OpenRaster(friction_path)
+	xsize, ysize = friction_ds.RasterXSize, friction_ds.RasterYSize
+	if (source_ds.RasterXSize, source_ds.RasterYSize) != (xsize, ysize):
+		raise Exception("Source and friction rasters differ in size")
+	source_band = source_ds.GetRasterBand(1)
+	friction_band = friction_ds.GetRasterBand(1)
+
+	geotransform = friction_ds.GetGeoTransform()
+	ew_res = float(abs(geotransform[1]))
+	ns_res = float(abs(geotransform[5]))
+
+	if scratch is None:
+		scratch = CostDistanceScratch()
+
+	output_ds = CreateRaster(output_path, friction_ds, gdal.GDT_Float32, COST_DISTANCE_NODATA)
+	output_band = output_ds.GetRasterBand(1)
+
+	windows = None
+	if max(xsize, ysize) > TILE_SIZE:
+		min_friction = friction_band.ComputeRasterMinMax(False)[0]
+		if min_friction > 0:
+			depth = int(math.ceil(max_cost / (min_friction * min(ew_res, ns_res))))
+			windows = list(_TileWindows(xsize, ysize, depth))
+			if sum(window[2] * window[3] for _, window in windows) > MAX_TILED_AREA_FACTOR * xsize * ysize:
+				windows = None
+	if windows is None:
+		windows = [((0, 0, xsize, ysize), (0, 0, xsize, ysize))]
+
+	for core, window in windows:
+		output = _CostDistanceWindow(source_band, friction_band, *window, ew_res, ns_res, max_cost, scratch)
+		x = core[0] - window[0]
+		y = core[1] - window[1]
+		output_band.WriteArray(output[y:y + core[3], x:x + core[2]], core[0], core[1])
+
+	output_band.FlushCache()
+	return output_path
+
+
+def RescaleCostDistanceRaster(input_path, scale, max_cost, output_path):
+	"""
+	Writes min(input * scale, max_cost) as a Float32 GeoTIFF with nodata -1,
+	in a single chunked pass. Used to convert GRASS r.cost output, which is
+	in cell steps, to map units.
+	"""
+	src = OpenRaster(input_path)
+	src_band = src.GetRasterBand(1)
+	src_nodata = src_band.GetNoDataValue()
+	dst = CreateRaster(output_path, src, gdal.GDT_Float32, COST_DISTANCE_NODATA)
+	dst_band = dst.GetRasterBand(1)
+	for xoff, yoff, xsize, ysize in RasterChunks(dst_band):
+		arr = src_band.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float32, copy=False)
+		valid = ValidMask(arr, src_nodata)
+		output = np.full(arr.shape, COST_DISTANCE_NODATA, dtype=np.float32)
+		np.multiply(arr, np.float32(scale), out=output, where=valid)
+		np.minimum(output, max_cost, out=output, where=valid)
+		dst_band.WriteArray(output, xoff, yoff)
+	dst_band.FlushCache()
+	return output_path
@@ -17,6 +17,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import math, os
+from concurrent.futures import ThreadPoolExecutor
 from qgis.PyQt.QtCore import (QCoreApplication,
 							  QSettings)
 from qgis.PyQt.QtGui import QColor
@@ -35,7 +36,10 @@ from qgis.core import (QgsColorRampShader,
 					   QgsRasterShader,
 					   QgsSingleBandPseudoColorRenderer,
 					   )
+from osgeo import gdal
 from ..xl import OpenWorkbook
+from . import cost_distance
+from .utils import CreateDispersalAndFunctionalityRasters, ReadRaster, RemapRaster
 from qgis.utils import iface
 
 
@@ -56,12 +60,12 @@ class ParameterSet:
 	NAME_PARAM = 'Network name'
 	DISPERSAL_PARAM = 'Average dispersal distance (metres)'
 	NETWORK_THRESHOLD_PARAM = 'Network threshold'
-	PARAMS = [NAME_PARAM, DISPERSAL_PARAM, NETWORK_THRESHOLD_PARAM]
+	PARAMS = (NAME_PARAM, DISPERSAL_PARAM, NETWORK_THRESHOLD_PARAM)
 	# Columns
 	QUALITY_COLUMN = 'Quality'
 	REPRODUCTION_COLUMN = 'Reproduction'
 	FRICTION_COLUMN = 'Friction'
-	COLUMNS = [QUALITY_COLUMN, QUALITY_COLUMN, FRICTION_COLUMN]
+	COLUMNS = (QUALITY_COLUMN, REPRODUCTION_COLUMN, FRICTION_COLUMN)
 
 	def __init__(self, parameters, columns):
 		self.parameters = parameters
@@ -121,6 +125,7 @@ class HabitatNetworkAlgorithm(QgsProcessingAlgorithm):
 
 		self._outputFolder = None
 		self._outputSubPath = None
+		self._createdDirs = set()
 		
 		self._layers = []
 
@@ -160,6 +165,7 @@ class HabitatNetworkAlgorithm(QgsProcessingAlgorithm):
 	def processAlgorithm(self, parameters, context, feedback):
 		try:
 			self._processingContext = context
+			self._costDistanceScratch = cost_distance.CostDistanceScratch()
 
 			props = self._collectProperties(parameters, context)
 
@@ -181,17 +187,28 @@ class HabitatNetworkAlgorithm(QgsProcessingAlgorithm):
 				feedback.pushInfo("parameters: " + str(parameterSet.parameters))
 				feedback.pushInfo("columns: " + str(parameterSet.columns))
 
+			# The biotope raster is decoded once and remapped for every parameter set
+			biotope_raster = ReadRaster(props[self.BIOTOPE_RASTER].source())
+
 			for parameterSetIndex, parameterSet in enumerate(batchParameters.parameterSets):
 				feedback.pushInfo("\nProcessing parameter set '%s'..." % parameterSet.parameters[ParameterSet.NAME_PARAM])
 				self._setOutputSubPath(parameterSet.parameters[ParameterSet.NAME_PARAM])
 				self._setOutputPrefix(parameterSet.parameters[ParameterSet.NAME_PARAM] + ' - ')
 
-				source_raster = self._createSourceRaster(context, 'Source Raster', props[self.BIOTOPE_RASTER], batchParameters.biotopeCodes, parameterSet.columns[ParameterSet.REPRODUCTION_COLUMN], feedback)
-				friction_raster = self._createFrictionRaster(context, 'Friction Raster', props[self.BIOTOPE_RASTER], batchParameters.biotopeCodes, parameterSet.columns[ParameterSet.FRICTION_COLUMN], feedback)
-				quality_raster = self._createQualityRaster(context, 'Quality Raster', props[self.BIOTOPE_RASTER], batchParameters.biotopeCodes, parameterSet.columns[ParameterSet.QUALITY_COLUMN], feedback)
+				# The three remaps only read the cached biotope array and write
+				# separate files, so they run concurrently. Layers are created
+				# here, in the algorithm's own thread.
+				with ThreadPoolExecutor(max_workers=3) as executor:
+					source_future = self._remapSourceRaster(executor, 'Source Raster', biotope_raster, batchParameters.biotopeCodes, parameterSet.columns[ParameterSet.REPRODUCTION_COLUMN], feedback)
+					friction_future = self._remapFrictionRaster(executor, 'Friction Raster', biotope_raster, batchParameters.biotopeCodes, parameterSet.columns[ParameterSet.FRICTION_COLUMN], feedback)
+					quality_future = self._remapQualityRaster(executor, 'Quality Raster', biotope_raster, batchParameters.biotopeCodes, parameterSet.columns[ParameterSet.QUALITY_COLUMN], feedback)
+				source_raster = self._loadRasterLayer(source_future.result()[0], 'Source Raster')
+				friction_path, friction_max = friction_future.result()
+				friction_raster = self._loadRasterLayer(friction_path, 'Friction Raster', friction_max, self.YELLOW_RED_RAMP)
+				quality_path, quality_max = quality_future.result()
+				quality_raster = self._loadRasterLayer(quality_path, 'Quality Raster', quality_max, self.YELLOW_BLUE_RAMP)
 				costdistance_raster = self._createCostDistanceRaster(context, 'Cost-Distance Raster', source_raster, friction_raster, parameterSet.parameters[ParameterSet.DISPERSAL_PARAM], parameterSet.parameters[ParameterSet.NETWORK_THRESHOLD_PARAM], feedback)
-				dispersal_raster = self._createDispersalRaster(context, 'Dispersal Raster', costdistance_raster, parameterSet.parameters[ParameterSet.DISPERSAL_PARAM], feedback)
-				functionality_raster = self._createFunctionalityRaster(context, 'Functionality Raster', dispersal_raster, quality_raster, feedback)
+				dispersal_raster, functionality_raster = self._createDispersalAndFunctionalityRasters(context, 'Dispersal Raster', 'Functionality Raster', costdistance_raster, quality_raster, parameterSet.parameters[ParameterSet.DISPERSAL_PARAM], feedback)
 
 				self._addLayer(source_raster, self._outputSubPath)
 				self._addLayer(functionality_raster, self._outputSubPath)
@@ -203,6 +220,7 @@ class HabitatNetworkAlgorithm(QgsProcessingAlgorithm):
 			return {}
 		finally:
 			self._processingContext = None
+			self._costDistanceScratch = None
 
 	def postProcessAlgorithm(self, context, feedback):
 
@@ -253,8 +271,9 @@ class HabitatNetworkAlgorithm(QgsProcessingAlgorithm):
 	def _setOutputSubPath(self, subPath):
 		if subPath:
 			full_path = os.path.join(self._outputFolder, subPath)
-			if not os.path.exists(full_path):
-				os.makedirs(full_path)
+			if full_path not in self._createdDirs:
+				os.makedirs(full_path, exist_ok=True)
+				self._createdDirs.add(full_path)
 		self._outputSubPath = subPath
 
 	def _setOutputPrefix(self, prefix):
@@ -269,40 +288,24 @@ class HabitatNetworkAlgorithm(QgsProcessingAlgorithm):
 		return os.path.join(path, fileName)
 
 	def _loadBatchParameters(self, path, feedback):
-		workbook = OpenWorkbook(path)
-		sheet_index = 0
-		feedback.pushInfo("Loading parameters from sheet #%d ('%s')..." %(sheet_index + 1, workbook.sheetName(sheet_index)))
-		rows = workbook.loadSheetData(sheet_index)
+		with OpenWorkbook(path) as workbook:
+			sheet_index = 0
+			feedback.pushInfo("Loading parameters from sheet #%d ('%s')..." %(sheet_index + 1, workbook.sheetName(sheet_index)))
+			# Only cell values are needed, so read the rows straight off the XML
+			# stream rather than through element trees and the sheet cache
+			rows = list(workbook.streamRows(sheet_index))
 
 		# Find index of table header row
-		headerRowIndex = None
-		for i,row in enumerate(rows):
-			if BatchParameters.BIOTOPE_CODE_HDR in row:
-				headerRowIndex = i
-				break
-		if not headerRowIndex:
+		headerRowIndex = next((i for i, row in enumerate(rows) if BatchParameters.BIOTOPE_CODE_HDR in row), None)
+		if headerRowIndex is None:
 			raise Exception('Column header "%s" not found.' % BatchParameters.BIOTOPE_CODE_HDR)
 		headerRow = rows[headerRowIndex]
 
 		# Find row headers by looking for network name row header
-		headerColumnIndex = None
-		for row_index in range(headerRowIndex):
-			row = rows[row_index]
-			for column_index in range(len(row)):
-				if row[column_index] == ParameterSet.PARAMS[0]:
-					headerColumnIndex = column_index
-					break
-			if headerColumnIndex:
-				break
-		if not headerColumnIndex:
+		headerColumnIndex = next((row.index(ParameterSet.PARAMS[0]) for row in rows[:headerRowIndex] if ParameterSet.PARAMS[0] in row), None)
+		if headerColumnIndex is None:
 			raise Exception('Row header "%s" not found.' % ParameterSet.PARAMS[0])
-		header_to_row_map = {}
-		for row_index in range(headerRowIndex):
-			row = rows[row_index]
-			if len(row) >= headerColumnIndex:
-				header_name = row[headerColumnIndex]
-				if header_name:
-					header_to_row_map[header_name] = row_index
+		header_to_row_map = {row[headerColumnIndex]: row_index for row_index, row in enumerate(rows[:headerRowIndex]) if len(row) > headerColumnIndex and row[headerColumnIndex]}
 
 		# Read biotope codes
 		biotopeCodes = self.columnValues(rows, headerRow.index(BatchParameters.BIOTOPE_CODE_HDR), headerRowIndex + 1, len(rows) - headerRowIndex - 1)
@@ -338,144 +341,94 @@ class HabitatNetworkAlgorithm(QgsProcessingAlgorithm):
 		return BatchParameters(biotopeCodes, parameterSets)
 
 	def columnValues(self, rows, column_index, first_row, row_count):
-		values = []
-		for i in range(row_count):
-			row = rows[first_row + i]
-			if column_index >= len(row) or (not row[column_index] and 0 != row[column_index]):
-				raise Exception("Value expected in cell %s" % CellRef(column_index, first_row + i))
-			values.append(row[column_index])
+		values = [row[column_index] if column_index < len(row) else None for row in rows[first_row:first_row + row_count]]
+		# Empty cells are None or '', look for them with C level scans and only
+		# locate the first one when there is one.
+		missing = [values.index(value) for value in (None, '') if value in values]
+		if missing:
+			raise Exception("Value expected in cell %s" % CellRef(column_index, first_row + min(missing)))
 		return values
 
-	def _createSourceRaster(self, context, title, biotope_raster, biotope_codes, reproduction_values, feedback):
+	def _remapSourceRaster(self, executor, title, biotope_raster, biotope_codes, reproduction_values, feedback):
 		feedback.pushInfo("\nCreating source raster layer...")
 		reproduction_biotope_codes = [biotope_codes[i] for i in range(len(reproduction_values)) if reproduction_values[i] == 1]
 		feedback.pushInfo("Reproduction biotope codes: " + str(reproduction_biotope_codes))
-		conditions = ')+('.join(['A==%d' % code for code in reproduction_biotope_codes])
-		formula = '((%s))*1' % conditions
-		rastercalculator_input = {
-			'INPUT_A':biotope_raster,
-			'BAND_A':1,
-			'INPUT_B':None,
-			'BAND_B':None,
-			'INPUT_C':None,
-			'BAND_C':None,
-			'INPUT_D':None,
-			'BAND_D':None,
-			'INPUT_E':None,
-			'BAND_E':None,
-			'INPUT_F':None,
-			'BAND_F':None,
-			'FORMULA':formula,
-			'NO_DATA':0,  
-			'PROJWIN':None,
-			'RTYPE':0,  # BYTE
-			'OPTIONS':'',
-			'EXTRA':'',
-			'OUTPUT':self._getOutputPath(title + '.tif')
-		}
-
-		feedback.pushInfo("Input to gdal:rastercalculator:\n" + str(rastercalculator_input))
-
-		rastercalculator_output = processing.run("gdal:rastercalculator", rastercalculator_input)
 
-		feedback.pushInfo("Output from gdal:rastercalculator:\n" + str(rastercalculator_output))
-
-		output_layer_path = rastercalculator_output['OUTPUT']
-		output_layer = QgsRasterLayer(output_layer_path)
-		output_layer.setName(title)
-
-		return output_layer
+		return executor.submit(
+			RemapRaster,
+			biotope_raster,
+			self._getOutputPath(title + '.tif'),
+			reproduction_biotope_codes,
+			[1] * len(reproduction_biotope_codes),
+			gdal.GDT_Byte,
+			0
+		)
 
-	def _createFrictionRaster(self, context, title, biotope_raster, biotope_codes, friction_values, feedback):
+	def _remapFrictionRaster(self, executor, title, biotope_raster, biotope_codes, friction_values, feedback):
 		feedback.pushInfo("\nCreating friction raster layer...")
-		formula = '+'.join(['(A==%d)*%f' % (biotope_codes[i], friction_values[i]) for i in range(len(friction_values)) if friction_values[i] > 0])
-		rastercalculator_input = {
-			'INPUT_A':biotope_raster,
-			'BAND_A':1,
-			'INPUT_B':None,
-			'BAND_B':None,
-			'INPUT_C':None,
-			'BAND_C':None,
-			'INPUT_D':None,
-			'BAND_D':None,
-			'INPUT_E':None,
-			'BAND_E':None,
-			'INPUT_F':None,
-			'BAND_F':None,
-			'FORMULA':formula,
-			'NO_DATA':-1,
-			'PROJWIN':None,
-			'RTYPE':5, # FLOAT32
-			'OPTIONS':'',
-			'EXTRA':'',
-			'OUTPUT':self._getOutputPath(title + '.tif')
-		}
-
-		feedback.pushInfo("Input to gdal:rastercalculator:\n" + str(rastercalculator_input))
-
-		rastercalculator_output = processing.run("gdal:rastercalculator", rastercalculator_input)
+		friction_indices = [i for i in range(len(friction_values)) if friction_values[i] > 0]
+		return executor.submit(
+			RemapRaster,
+			biotope_raster,
+			self._getOutputPath(title + '.tif'),
+			[biotope_codes[i] for i in friction_indices],
+			[friction_values[i] for i in friction_indices],
+			gdal.GDT_Float32,
+			-1
+		)
 
-		feedback.pushInfo("Output from gdal:rastercalculator:\n" + str(rastercalculator_output))
+	def _remapQualityRaster(self, executor, title, biotope_raster, biotope_codes, quality_values, feedback):
+		feedback.pushInfo("\nCreating quality raster layer...")
+		quality_indices = [i for i in range(len(quality_values)) if quality_values[i] > 0]
+		return executor.submit(
+			RemapRaster,
+			biotope_raster,
+			self._getOutputPath(title + '.tif'),
+			[biotope_codes[i] for i in quality_indices],
+			[int(quality_values[i]) for i in quality_indices],
+			gdal.GDT_Byte,
+			255
+		)
 
-		# Load layer
-		output_layer_path = rastercalculator_output['OUTPUT']
-		output_layer = QgsRasterLayer(output_layer_path)
-		output_layer.setName(title)
+	def _loadRasterLayer(self, path, title, max_value=None, colors=None):
+		layer = QgsRasterLayer(path)
+		layer.setName(title)
+		if colors is not None:
+			self.setRampShader(layer, max_value, colors)
+		return layer
 
-		# Apply shader to raster
-		self.setRampShader(output_layer, None, self.YELLOW_RED_RAMP)
+	def _createCostDistanceRaster(self, context, title, source_raster, friction_raster, mean_migration_distance, dispersal_threshold, feedback):
 
-		return output_layer
+		feedback.pushInfo("\nCreating cost-distance raster layer...")
 
-	def _createQualityRaster(self, context, title, biotope_raster, biotope_codes, quality_values, feedback):
-		feedback.pushInfo("\nCreating quality raster layer...")
-		formula = '+'.join(['(A==%d)*%d' % (biotope_codes[i], quality_values[i]) for i in range(len(quality_values)) if quality_values[i] > 0])
-		rastercalculator_input = {
-			'INPUT_A':biotope_raster,
-			'BAND_A':1,
-			'INPUT_B':None,
-			'BAND_B':None,
-			'INPUT_C':None,
-			'BAND_C':None,
-			'INPUT_D':None,
-			'BAND_D':None,
-			'INPUT_E':None,
-			'BAND_E':None,
-			'INPUT_F':None,
-			'BAND_F':None,
-			'FORMULA':formula,
-			'NO_DATA':255,  
-			'PROJWIN':None,
-			'RTYPE':0,  # BYTE
-			'OPTIONS':'',
-			'EXTRA':'',
-			'OUTPUT':self._getOutputPath(title + '.tif')
-		}
+		max_value = math.ceil(-mean_migration_distance * math.log(dispersal_threshold))
 
-		feedback.pushInfo("Input to gdal:rastercalculator:\n" + str(rastercalculator_input))
+		feedback.pushInfo("Maximum cost-distance: %.0f" % (max_value))
 
-		rastercalculator_output = processing.run("gdal:rastercalculator", rastercalculator_input)
+		output_title = title + (" max%dm" % max_value)
 
-		feedback.pushInfo("Output from gdal:rastercalculator:\n" + str(rastercalculator_output))
+		if cost_distance.AVAILABLE:
+			output_layer_path = cost_distance.CreateCostDistanceRaster(
+				source_raster.source(),
+				friction_raster.source(),
+				max_value,
+				self._getOutputPath(output_title + '.tif'),
+				self._costDistanceScratch
+			)
+		else:
+			output_layer_path = self._runGrassCostDistance(source_raster, friction_raster, max_value, output_title, feedback)
 
-		# Load layer
-		output_layer_path = rastercalculator_output['OUTPUT']
 		output_layer = QgsRasterLayer(output_layer_path)
-		output_layer.setName(title)
+		output_layer.setName(output_title)
 
 		# Apply shader to raster
-		self.setRampShader(output_layer, None, self.YELLOW_BLUE_RAMP)
+		self.setRampShader(output_layer, max_value, self.GREEN_YELLOW_RED_RAMP)
 
 		return output_layer
 
-	def _createCostDistanceRaster(self, context, title, source_raster, friction_raster, mean_migration_distance, dispersal_threshold, feedback):
-
-		feedback.pushInfo("\nCreating cost-distance raster layer...")
-
-		max_value = math.ceil(-mean_migration_distance * math.log(dispersal_threshold))
-
-		feedback.pushInfo("Maximum cost-distance: %.0f" % (max_value))
-
+	def _runGrassCostDistance(self, source_raster, friction_raster, max_value, output_title, feedback):
+		# r.cost accumulates friction per cell step, scale it to map units
+		cellsize = friction_raster.rasterUnitsPerPixelX()
 		const_distance_input = {
 			'input':friction_raster,
 			'start_coordinates':None,
@@ -485,7 +438,7 @@ class HabitatNetworkAlgorithm(QgsProcessingAlgorithm):
 			'start_points':None,
 			'stop_points':None,
 			'start_raster':source_raster,
-			'max_cost': max_value / 10,
+			'max_cost': max_value / cellsize,
 			'null_cost': None,
 			'memory':300,
 			'output':os.path.join(QgsProcessingUtils.tempFolder(), 'cost_distance_intermediate.tif'),
@@ -507,154 +460,40 @@ class HabitatNetworkAlgorithm(QgsProcessingAlgorithm):
 
 		feedback.pushInfo("grass7:r.cost output:\n" + str(cost_distance_output))
 
-		output_title = title + (" max%dm" % max_value)
-
-		feedback.pushInfo("\nCalling gdal:rastercalculator to post-process cost-dist output...")
-		raster_calc_input = {
-			'INPUT_A': cost_distance_output['output'],
-			'BAND_A':1,
-			'INPUT_B':None,
-			'BAND_B':None,
-			'INPUT_C':None,
-			'BAND_C':None,
-			'INPUT_D':None,
-			'BAND_D':None,
-			'INPUT_E':None,
-			'BAND_E':None,
-			'INPUT_F':None,
-			'BAND_F':None,
-			'FORMULA':'minimum(A*10, %f)' % (max_value),
-			'NO_DATA':-1,
-			'PROJWIN':None,
-			'RTYPE':5,  # 5=Float32
-			'OPTIONS':'',
-			'EXTRA':'',
-			'OUTPUT': self._getOutputPath(output_title + '.tif')
-		}
-		feedback.pushInfo("input: " + str(raster_calc_input))
-		raster_calc_output = processing.run(
-			"gdal:rastercalculator", 
-			raster_calc_input
-		)
-
-		feedback.pushInfo("gdal:rastercalculator output:\n" + str(raster_calc_output))
-		
-		output_layer_path = raster_calc_output['OUTPUT']
-		output_layer = QgsRasterLayer(output_layer_path)
-		output_layer.setName(output_title)
-
-		# Apply shader to raster
-		self.setRampShader(output_layer, max_value, self.GREEN_YELLOW_RED_RAMP)
-
-		return output_layer
-
-	def _createDispersalRaster(self, context, title, costdistance_raster, average_dispersal_distance, feedback):
-
-		feedback.pushInfo("\nCreating dispersal raster layer...")
-
-		raster_calc_input = {
-			'INPUT_A': costdistance_raster,
-			'BAND_A':1,
-			'INPUT_B':None,
-			'BAND_B':None,
-			'INPUT_C':None,
-			'BAND_C':None,
-			'INPUT_D':None,
-			'BAND_D':None,
-			'INPUT_E':None,
-			'BAND_E':None,
-			'INPUT_F':None,
-			'BAND_F':None,
-			'FORMULA':'exp(-A/%f)' % (average_dispersal_distance),
-			'NO_DATA':0,
-			'PROJWIN':None,
-			'RTYPE':5,  # 5=Float32
-			'OPTIONS':'',
-			'EXTRA':'',
-			'OUTPUT': self._getOutputPath(title + '.tif')
-		}
-		feedback.pushInfo("input: " + str(raster_calc_input))
-		raster_calc_output = processing.run(
-			"gdal:rastercalculator", 
-			raster_calc_input
+		return cost_distance.RescaleCostDistanceRaster(
+			cost_distance_output['output'],
+			cellsize,
+			max_value,
+			self._getOutputPath(output_title + '.tif')
 		)
 
-		feedback.pushInfo("gdal:rastercalculator output:\n" + str(raster_calc_output))
-		
-		# Add Layer
-		output_layer_path = raster_calc_output['OUTPUT']
-		output_layer = QgsRasterLayer(output_layer_path)
-		output_layer.setName(title)
+	def _createDispersalAndFunctionalityRasters(self, context, dispersal_title, functionality_title, costdistance_raster, quality_raster, average_dispersal_distance, feedback):
 
-		# Apply shader to raster
-		self.setRampShader(output_layer, 1, self.RED_YELLOW_GREEN_RAMP)
+		feedback.pushInfo("\nCreating dispersal and habitat functionality raster layers...")
 
-		return output_layer
-
-	def _createFunctionalityRaster(self, context, title, dispersal_raster, quality_raster, feedback):
-
-		feedback.pushInfo("\nCreating habitat functionality raster layer...")
-
-		raster_calc_input = {
-			'INPUT_A': dispersal_raster,
-			'BAND_A':1,
-			'INPUT_B':quality_raster,
-			'BAND_B':1,
-			'INPUT_C':None,
-			'BAND_C':None,
-			'INPUT_D':None,
-			'BAND_D':None,
-			'INPUT_E':None,
-			'BAND_E':None,
-			'INPUT_F':None,
-			'BAND_F':None,
-			'FORMULA':'A*B',
-			'NO_DATA':-1,
-			'PROJWIN':None,
-			'RTYPE':5,  # 5=Float32
-			'OPTIONS':'',
-			'EXTRA':'',
-			'OUTPUT': os.path.join(QgsProcessingUtils.tempFolder(), 'functionality_with_null.tif'),
-		}
-		feedback.pushInfo("input: " + str(raster_calc_input))
-		raster_calc_output = processing.run(
-			"gdal:rastercalculator", 
-			raster_calc_input
+		dispersal_path, functionality_path, functionality_max = CreateDispersalAndFunctionalityRasters(
+			costdistance_raster.source(),
+			quality_raster.source(),
+			average_dispersal_distance,
+			self._getOutputPath(dispersal_title + '.tif'),
+			self._getOutputPath(functionality_title + '.tif')
 		)
 
-		feedback.pushInfo("gdal:rastercalculator output:\n" + str(raster_calc_output))
-		
+		# Add Layers
+		dispersal_layer = QgsRasterLayer(dispersal_path)
+		dispersal_layer.setName(dispersal_title)
+		functionality_layer = QgsRasterLayer(functionality_path)
+		functionality_layer.setName(functionality_title)
 
-		feedback.pushInfo("\nConverting NULL -> ZERO in functionality raster...")
-		null_output = processing.run("grass7:r.null", {
-			'map': raster_calc_output['OUTPUT'],
-			'setnull':'',
-			'null':0,
-			'-f':False,
-			'-i':False,
-			'-n':False,
-			'-c':False,
-			'-r':False,
-			'output': self._getOutputPath(title + '.tif'),
-			'GRASS_REGION_PARAMETER':None,
-			'GRASS_REGION_CELLSIZE_PARAMETER':0,
-			'GRASS_RASTER_FORMAT_OPT':'',
-			'GRASS_RASTER_FORMAT_META':''
-		})
-
-		feedback.pushInfo("grass7:r.null output:\n" + str(null_output))
-
-		# Add Layer
-		output_layer_path = null_output['output']
-		output_layer = QgsRasterLayer(output_layer_path)
-		output_layer.setName(title)
+		# Apply shaders to rasters
+		self.setRampShader(dispersal_layer, 1, self.RED_YELLOW_GREEN_RAMP)
+		self.setRampShader(functionality_layer, functionality_max, self.BLUE_GREEN_YELLOW_RED_RAMP)
 
-		# Apply shader to raster
-		self.setRampShader(output_layer, None, self.BLUE_GREEN_YELLOW_RED_RAMP)
-		
-		return output_layer
+		return dispersal_layer, functionality_layer
 
 	def setRampShader(self, layer, max_value, colors):
+		# Rasters written by this algorithm pass the max they saw while writing,
+		# only fall back to scanning the raster when it is not known.
 		if max_value is None:
 			stats = layer.dataProvider().bandStatistics(1, QgsRasterBandStats.Max, layer.extent(), 0)
 			max_value = stats.maximumValue
@@ -670,14 +509,10 @@ class HabitatNetworkAlgorithm(QgsProcessingAlgorithm):
 		layer.setRenderer(renderer)
 
 	def _getColumnValues(self, rows, column_name, header_row_index, feedback = None):
-		column_index = None
-		for i, text in enumerate(rows[header_row_index]):
-			if text == column_name:
-				column_index = i
-				break
-		if column_index is None:
+		if column_name not in rows[header_row_index]:
 			raise Exception("Column '%s' not found" % column_name)
-		values = [rows[i+header_row_index+1][column_index] for i in range(len(rows) - header_row_index - 1)]
+		column_index = rows[header_row_index].index(column_name)
+		values = [row[column_index] for row in rows[header_row_index + 1:]]
 		if feedback is not None:
 			feedback.pushInfo("%s: %s" % (column_name, str(values)))
 		return values
@@ -0,0 +1,239 @@
+"""
+Habitat Network Analysis Tool
+Copyright (C) 2023  Martin Fitger, Oskar Kindvall, Ioanna Stavroulaki, Meta Berghauser Pont
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import math
+import numpy as np
+from typing import NamedTuple
+from osgeo import gdal, gdal_array
+try:
+	from numba import njit, prange
+except ImportError:
+	njit = None
+
+# Approximate number of pixels processed per chunk by the block loops
+CHUNK_PIXELS = 1 << 22
+
+# Creation options of all GeoTIFFs written by the algorithm. Most outputs are
+# smooth or have few distinct values and compress well, which also cuts the
+# I/O of the later stages that read them back. PREDICTOR is added per type.
+GTIFF_OPTIONS = [
+	'COMPRESS=DEFLATE',
+	'TILED=YES',
+	'BLOCKXSIZE=256',
+	'BLOCKYSIZE=256',
+	'NUM_THREADS=ALL_CPUS',
+	'BIGTIFF=IF_SAFER',
+]
+
+
+def OpenRaster(path):
+	dataset = gdal.Open(path)
+	if dataset is None:
+		raise Exception("Unable to open raster '%s'" % path)
+	return dataset
+
+
+class RasterData(NamedTuple):
+	array: np.ndarray
+	geotransform: tuple
+	projection: str
+	nodata: float
+
+
+def ReadRaster(path):
+	"""
+	Reads the first band of a raster into memory along with its georeferencing.
+	"""
+	dataset = OpenRaster(path)
+	band = dataset.GetRasterBand(1)
+	return RasterData(band.ReadAsArray(), dataset.GetGeoTransform(), dataset.GetProjection(), band.GetNoDataValue())
+
+
+def _CreateGTiff(path, xsize, ysize, geotransform, projection, data_type, nodata):
+	# Floating point predictor for float rasters, horizontal differencing otherwise
+	predictor = 3 if data_type in (gdal.GDT_Float32, gdal.GDT_Float64) else 2
+	driver = gdal.GetDriverByName('GTiff')
+	dataset = driver.Create(path, xsize, ysize, 1, data_type, options=GTIFF_OPTIONS + ['PREDICTOR=%d' % predictor])
+	if dataset is None:
+		raise Exception("Unable to create raster '%s'" % path)
+	dataset.SetGeoTransform(geotransform)
+	dataset.SetProjection(projection)
+	if nodata is not None:
+		dataset.GetRasterBand(1).SetNoDataValue(nodata)
+	return dataset
+
+
+def CreateRaster(path, like, data_type, nodata=None):
+	"""
+	Creates a single band GeoTIFF with the size, geotransform and projection
+	of the dataset 'like'.
+	"""
+	return _CreateGTiff(path, like.RasterXSize, like.RasterYSize, like.GetGeoTransform(), like.GetProjection(), data_type, nodata)
+
+
+def RasterChunks(band, chunk_pixels=CHUNK_PIXELS):
+	"""
+	Yields (xoff, yoff, xsize, ysize) windows covering the band. Windows span
+	full rows and whole rows of blocks, so every block is decoded only once.
+	"""
+	xsize, ysize = band.XSize, band.YSize
+	block_ysize = band.GetBlockSize()[1]
+	rows = max(1, chunk_pixels // max(1, xsize) // block_ysize) * block_ysize
+	for yoff in range(0, ysize, rows):
+		yield 0, yoff, xsize, min(rows, ysize - yoff)
+
+
+def CreateLookupTable(codes, values, dtype, default):
+	"""
+	Returns (lut, first_code) where lut[code - first_code] is the value of
+	code, and 'default' for codes in the range that have no value.
+	"""
+	codes = np.asarray(codes, dtype=np.int64)
+	if codes.size == 0:
+		return np.full(1, default, dtype=dtype), 0
+	first_code = int(codes.min())
+	lut = np.full(int(codes.max()) - first_code + 1, default, dtype=dtype)
+	lut[codes - first_code] = values
+	return lut, first_code
+
+
+def RemapArray(arr, lut, first_code, default, nodata, src_nodata=None):
+	"""
+	Maps every value of arr through the lookup table with a single indexed
+	load per pixel. Values outside the table get 'default', and input nodata
+	(src_nodata) pixels get 'nodata'.
+	"""
+	if arr.dtype.kind == 'f':
+		valid = np.floor(arr) == arr  # Also rejects NaN
+		index = np.where(valid, arr, first_code).astype(np.int64)
+	else:
+		valid = None
+		index = arr.astype(np.int64)
+	index -= first_code
+	in_range = (index >= 0) & (index < lut.size)
+	valid = in_range if valid is None else valid & in_range
+	out = np.full(arr.shape, default, dtype=lut.dtype)
+	out[valid] = lut[index[valid]]
+	if src_nodata is not None:
+		out[np.isnan(arr) if np.isnan(src_nodata) else arr == src_nodata] = nodata
+	return out
+
+
+def RemapRaster(raster, output_path, codes, values, data_type, nodata, default=0):
+	"""
+	Writes the RasterData 'raster' to a new GeoTIFF with every pixel value
+	replaced through a code -> value lookup table. Equivalent to a raster
+	calculator expression of the form (A==code1)*value1 + (A==code2)*value2
+	+ ..., but visits every pixel once instead of once per code.
+	Returns (output_path, max_value), max_value being the largest value
+	written other than nodata, or None if there is none.
+	"""
+	dtype = gdal_array.GDALTypeCodeToNumericTypeCode(data_type)
+	lut, first_code = CreateLookupTable(codes, values, dtype, default)
+	ysize, xsize = raster.array.shape
+	dst = _CreateGTiff(output_path, xsize, ysize, raster.geotransform, raster.projection, data_type, nodata)
+	dst_band = dst.GetRasterBand(1)
+	max_value = None
+	# Chunks follow the tiles of the output, so each tile is compressed once
+	for xoff, yoff, chunk_xsize, chunk_ysize in RasterChunks(dst_band):
+		out = RemapArray(raster.array[yoff:yoff + chunk_ysize], lut, first_code, default, nodata, raster.nodata)
+		dst_band.WriteArray(out, xoff, yoff)
+		max_value = _MaxValue(out, nodata, max_value)
+	dst_band.FlushCache()
+	return output_path, max_value
+
+
+def _MaxValue(arr, nodata, max_value):
+	# Running maximum of the data (non-nodata) values of the chunks written
+	values = arr[ValidMask(arr, nodata)] if nodata is not None else arr
+	if values.size == 0:
+		return max_value
+	chunk_max = float(values.max())
+	return chunk_max if max_value is None else max(max_value, chunk_max)
+
+
+def ValidMask(arr, nodata):
+	"""
+	Returns a boolean array that is True where arr holds data.
+	"""
+	if nodata is None:
+		return np.ones(arr.shape, dtype=bool)
+	if np.isnan(nodata):
+		return ~np.isnan(arr)
+	return arr != nodata
+
+
+def _DispersalFunctionalityNumPy(cd, q, scale, cd_valid, q_valid, dispersal, functionality):
+	np.multiply(cd, scale, out=dispersal)
+	np.exp(dispersal, out=dispersal)
+	dispersal[~cd_valid] = 0
+	np.multiply(dispersal, q, out=functionality)
+	functionality[~q_valid] = 0
+
+
+def _DispersalFunctionalityLoops(cd, q, scale, cd_valid, q_valid, dispersal, functionality):
+	for i in prange(cd.shape[0]):
+		for j in range(cd.shape[1]):
+			d = math.exp(cd[i, j] * scale) if cd_valid[i, j] else np.float32(0)
+			dispersal[i, j] = d
+			functionality[i, j] = d * np.float32(q[i, j]) if q_valid[i, j] else np.float32(0)
+
+
+# Writes exp(cd * scale) to dispersal and dispersal * q to functionality,
+# both 0 where the respective input is not valid. With numba the loops are
+# compiled to vectorized code running over the rows on all cores.
+if njit is not None:
+	DispersalFunctionalityKernel = njit(parallel=True, fastmath=True, cache=True)(_DispersalFunctionalityLoops)
+else:
+	DispersalFunctionalityKernel = _DispersalFunctionalityNumPy
+
+
+def CreateDispersalAndFunctionalityRasters(costdistance_path, quality_path, average_dispersal_distance, dispersal_path, functionality_path):
+	"""
+	Computes, in a single pass over the cost-distance and quality rasters,
+	the dispersal raster exp(-costdistance / average_dispersal_distance)
+	(nodata 0) and the habitat functionality raster dispersal * quality,
+	with 0 wherever either input has no data. Returns the two paths and
+	the maximum functionality value.
+	"""
+	cd_ds = OpenRaster(costdistance_path)
+	q_ds = OpenRaster(quality_path)
+	if (cd_ds.RasterXSize, cd_ds.RasterYSize) != (q_ds.RasterXSize, q_ds.RasterYSize):
+		raise Exception("Cost-distance and quality rasters differ in size")
+	cd_band = cd_ds.GetRasterBand(1)
+	q_band = q_ds.GetRasterBand(1)
+	cd_nodata = cd_band.GetNoDataValue()
+	q_nodata = q_band.GetNoDataValue()
+	dispersal_ds = CreateRaster(dispersal_path, cd_ds, gdal.GDT_Float32, 0)
+	functionality_ds = CreateRaster(functionality_path, cd_ds, gdal.GDT_Float32)
+	dispersal_band = dispersal_ds.GetRasterBand(1)
+	functionality_band = functionality_ds.GetRasterBand(1)
+	scale = np.float32(-1.0 / average_dispersal_distance)
+	functionality_max = None
+	for xoff, yoff, xsize, ysize in RasterChunks(cd_band):
+		cd = cd_band.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float32, copy=False)
+		q = q_band.ReadAsArray(xoff, yoff, xsize, ysize)
+		dispersal = np.empty(cd.shape, dtype=np.float32)
+		functionality = np.empty(cd.shape, dtype=np.float32)
+		DispersalFunctionalityKernel(cd, q, scale, ValidMask(cd, cd_nodata), ValidMask(q, q_nodata), dispersal, functionality)
+		dispersal_band.WriteArray(dispersal, xoff, yoff)
+		functionality_band.WriteArray(functionality, xoff, yoff)
+		functionality_max = _MaxValue(functionality, None, functionality_max)
+	dispersal_band.FlushCache()
+	functionality_band.FlushCache()
+	return dispersal_path, functionality_path, functionality_max
@@ -16,117 +16,379 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import xml.etree.ElementTree as ET
+try:
+	from lxml import etree as ET
+	HAS_LXML = True
+except ImportError:
+	import xml.etree.ElementTree as ET
+	HAS_LXML = False
+try:
+	from deflate import deflate_decompress
+except ImportError:
+	deflate_decompress = None
+import copy
+import io
+import mmap
+import os
+import string
+import sys
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+from typing import NamedTuple
+from xml.parsers import expat
 
-def OpenWorkbook(path):
-	return Workbook(path)
+_NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
 
+ROW_TAG = '{%s}row' % _NS_MAIN
+C_TAG = '{%s}c' % _NS_MAIN
+V_TAG = '{%s}v' % _NS_MAIN
+SI_TAG = '{%s}si' % _NS_MAIN
+R_TAG = '{%s}r' % _NS_MAIN
+T_TAG = '{%s}t' % _NS_MAIN
+SHEETS_TAG = '{%s}sheets' % _NS_MAIN
+SHEET_TAG = '{%s}sheet' % _NS_MAIN
+REL_TAG = '{%s}Relationship' % _NS_PKG_REL
+R_ID_ATTR = '{%s}id' % _NS_REL
+
+XML_READ_BUFFER_SIZE = 1 << 18
+
+if HAS_LXML:
+	# Shared string items, and the text of a plain (<t>) or rich text (<r><t>) item
+	_SI_XPATH = ET.XPath('./main:si', namespaces={'main': _NS_MAIN})
+	_SI_TEXT_XPATH = ET.XPath('./main:t/text() | ./main:r/main:t/text()', namespaces={'main': _NS_MAIN}, smart_strings=False)
+
+def OpenWorkbook(path, eager=False):
+	return Workbook(path, eager)
+
+@lru_cache(maxsize=100000)
 def ValueFromString(s):
-		try:
+		if not s:
+			return s
+		if s.isdecimal() or (s[0] == '-' and s[1:].isdecimal()):
 			return int(s)
-		except:
-			pass
 		try:
 			return float(s)
-		except:
+		except ValueError:
 			pass
 		return s
 
-class SheetDef:
-	def __init__(self, name, rid):
-		self.name = name
-		self.rid = rid
+def ColumnIndex(letters):
+	index = 0
+	for letter in letters:
+		index = index * 26 + ord(letter) - ord('A') + 1
+	return index - 1
+
+# Zero based column index for column letters A..ZZ
+COLUMN_INDICES = {a: ColumnIndex(a) for a in string.ascii_uppercase}
+COLUMN_INDICES.update({a + b: ColumnIndex(a + b) for a in string.ascii_uppercase for b in string.ascii_uppercase})
+
+def ParseRow(row_node, shared_strings):
+	# Hot loop of sheet loading, everything it touches per cell is bound to a local
+	c_tag = C_TAG
+	v_tag = V_TAG
+	digits = string.digits
+	column_indices = COLUMN_INDICES
+	value_from_string = ValueFromString
+	cells = []
+	max_col = -1
+	for c_node in row_node.findall(c_tag):
+		letters = c_node.get('r').rstrip(digits)
+		col = column_indices.get(letters)
+		if col is None:
+			col = ColumnIndex(letters)
+		if col > max_col:
+			max_col = col
+		# Styled but empty cells have no children, skip them without a find()
+		if len(c_node) == 0:
+			continue
+		v_node = c_node.find(v_tag)
+		if v_node is None:
+			continue
+		# Most cells are numbers (no type) or shared strings, test those first
+		t = c_node.get('t')
+		if t is None:
+			value = value_from_string(v_node.text)
+		elif t == 's':
+			value = shared_strings[int(v_node.text)]
+		elif t == 'b':
+			value = v_node.text == '1'
+		elif t == 'n':
+			value = value_from_string(v_node.text)
+		else:
+			value = v_node.text
+		cells.append((col, value))
+	return RowFromCells(cells, max_col, row_node.get('spans'))
+
+def RowFromCells(cells, max_col, spans):
+	# 'spans' is optional, when present it covers the columns of the whole
+	# block of rows and so may be wider than the cells of this row
+	length = max_col + 1
+	if spans:
+		length = max(length, int(spans[spans.rfind(':') + 1:]))
+	row = [None] * length
+	for col, value in cells:
+		row[col] = value
+	return row
+
+def CellValue(t, text, shared_strings):
+	if t is None or t == 'n':
+		return ValueFromString(text)
+	if t == 's':
+		return shared_strings[int(text)]
+	if t == 'b':
+		return text == '1'
+	return text
+
+class SheetDef(NamedTuple):
+	name: str
+	rid: str
+
+class MappedFile(mmap.mmap):
+	# zipfile requires seekable(), which mmap only provides from Python 3.13
+	def seekable(self):
+		return True
 
 class Workbook:
-	def __init__(self, path):
-		self._archive = zipfile.ZipFile(path, 'r')
-		self._rels = self._loadRels()
-		self._sheetDefs = self._loadSheetDefs()
-		self._sharedStrings = self._loadSharedStrings()
+	def __init__(self, path, eager=False):
+		# Map the file into memory so member reads are served from the page
+		# cache instead of through a buffered file object
+		with open(path, 'rb') as f:
+			self._mapping = MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			self._archive = zipfile.ZipFile(self._mapping, 'r')
+		except:
+			self._mapping.close()
+			raise
+		self._prefetched = {}
+		self._sheetCache = {}
+		self._rels = None
+		self._sheetDefs = None
+		self._sharedStrings = None
+		if eager:
+			self._prefetch(['xl/sharedStrings.xml'] + [self._sheetPath(i) for i in range(self.sheetCount())])
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		for future in self._prefetched.values():
+			future.cancel()
+		wait(self._prefetched.values())
+		self._prefetched = {}
+		self._archive.close()
+		self._mapping.close()
+
+	# Workbook parts are parsed on first use, so that e.g. listing sheet
+	# names does not pay for parsing the shared strings.
+	def _getRels(self):
+		if self._rels is None:
+			self._rels = self._loadRels()
+		return self._rels
+
+	def _getSheetDefs(self):
+		if self._sheetDefs is None:
+			self._sheetDefs = self._loadSheetDefs()
+		return self._sheetDefs
+
+	def _getSharedStrings(self):
+		if self._sharedStrings is None:
+			self._sharedStrings = self._loadSharedStrings()
+		return self._sharedStrings
 
 	def loadSheetData(self, index):
-		ns = {
-			'': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
-		}
-		row_tag = '{%s}row' % ns['']
-		c_tag = '{%s}c' % ns['']
-		v_tag = '{%s}v' % ns['']
-		doc = self._loadXml(self._sheetPath(index))
-		root = doc.getroot()
-		raw_rows = []
-		sheetData_node = root.find('{%s}sheetData' % ns[''])
-		for row_node in sheetData_node.findall(row_tag):
-			spans = row_node.attrib['spans']
-			length = int(spans[spans.find(':') + 1:])
-			row = [None] * length
-			for c_node in row_node.findall(c_tag):
-				ref = c_node.attrib['r']
-				col = ord(ref[0]) - ord('A')
-				t = c_node.attrib.get('t')
-				v_node = c_node.find(v_tag)
-				if v_node is not None:
-					if t == 's':
-						row[col] = self._sharedStrings[int(v_node.text)]
-					else:
-						row[col] = ValueFromString(v_node.text)
-			raw_rows.append((int(row_node.get('r')), row))
-		row_count = max([r[0] for r in raw_rows])
-		rows = [[]] * row_count
-		for r in raw_rows:
-			rows[r[0] - 1] = r[1]
+		rows = self._sheetCache.get(index)
+		if rows is not None:
+			return rows
+		row_tag = ROW_TAG
+		shared_strings = self._getSharedStrings()
+		rows_by_r = {}
+		max_r = 0
+		with self._openEntry(self._sheetPath(index)) as f:
+			# Stream the sheet row by row instead of building the whole DOM
+			if HAS_LXML:
+				context = ET.iterparse(f, events=('end',), tag=row_tag)
+			else:
+				context = ET.iterparse(f, events=('end',))
+			for _, row_node in context:
+				if row_node.tag != row_tag:
+					continue
+				row = ParseRow(row_node, shared_strings)
+				r = int(row_node.get('r'))
+				rows_by_r[r] = row
+				if r > max_r:
+					max_r = r
+				# Release the processed row (and, with lxml, its preceding siblings)
+				row_node.clear()
+				if HAS_LXML:
+					while row_node.getprevious() is not None:
+						del row_node.getparent()[0]
+		# Missing rows get their own empty list each (no shared aliasing)
+		rows = [rows_by_r.get(r, []) for r in range(1, max_r + 1)]
+		self._sheetCache[index] = rows
 		return rows
 
+	def streamRows(self, index):
+		# Yields the rows of a sheet one at a time (including empty lists for
+		# missing rows, as in loadSheetData) straight from an expat parser,
+		# without building any element tree. Rows are not cached.
+		shared_strings = self._getSharedStrings()
+		digits = string.digits
+		row_name = ROW_TAG[1:]
+		c_name = C_TAG[1:]
+		v_name = V_TAG[1:]
+		completed_rows = []
+		row = None  # [r, spans, max_col, cells] of the open <row>
+		cell = None  # (col, t) of the open <c>
+		text = None  # text chunks of the open <v>
+
+		def startElement(name, attrs):
+			nonlocal row, cell, text
+			if name == c_name:
+				letters = attrs['r'].rstrip(digits)
+				col = COLUMN_INDICES.get(letters)
+				if col is None:
+					col = ColumnIndex(letters)
+				if col > row[2]:
+					row[2] = col
+				cell = (col, attrs.get('t'))
+			elif name == v_name:
+				if cell is not None:
+					text = []
+			elif name == row_name:
+				row = [int(attrs['r']), attrs.get('spans'), -1, []]
+
+		def endElement(name):
+			nonlocal row, cell, text
+			if name == v_name:
+				if text is not None:
+					row[3].append((cell[0], CellValue(cell[1], ''.join(text) if text else None, shared_strings)))
+					text = None
+			elif name == c_name:
+				cell = None
+			elif name == row_name:
+				completed_rows.append((row[0], RowFromCells(row[3], row[2], row[1])))
+				row = None
+
+		def characterData(data):
+			if text is not None:
+				text.append(data)
+
+		parser = expat.ParserCreate(namespace_separator='}')
+		parser.buffer_text = True
+		parser.StartElementHandler = startElement
+		parser.EndElementHandler = endElement
+		parser.CharacterDataHandler = characterData
+		next_r = 1
+		with self._openEntry(self._sheetPath(index)) as f:
+			while True:
+				data = f.read(XML_READ_BUFFER_SIZE)
+				parser.Parse(data, not data)
+				for r, cells in completed_rows:
+					while next_r < r:
+						yield []
+						next_r += 1
+					yield cells
+					next_r = r + 1
+				completed_rows.clear()
+				if not data:
+					break
+
+	def clearCache(self):
+		self._sheetCache = {}
+
 	def sheetCount(self):
-		return len(self._sheetDefs)
+		return len(self._getSheetDefs())
 
 	def sheetName(self, index):
-		return self._sheetDefs[index].name
+		return self._getSheetDefs()[index].name
 
 	def _loadRels(self):
 		root = self._loadXml('xl/_rels/workbook.xml.rels').getroot()
 		rels = {}
 		for child in root:
-			if 'Relationship' == self._stripNameSpace(child.tag):
+			if child.tag == REL_TAG:
 				rels[child.get('Id')] = child.get('Target')
 		return rels
 
 	def _loadSheetDefs(self):
-		ns = {
-			'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
-		}
 		doc = self._loadXml('xl/workbook.xml')
 		root = doc.getroot()
 		sheet_defs = []
 		for child in root:
-			if 'sheets' == self._stripNameSpace(child.tag):
+			if child.tag == SHEETS_TAG:
 				for child2 in child:
-					if 'sheet' == self._stripNameSpace(child2.tag):
+					if child2.tag == SHEET_TAG:
 						name = child2.get('name')
-						rid = child2.get('{%s}id' % ns['r'])
+						rid = child2.get(R_ID_ATTR)
 						sheet_defs.append(SheetDef(name, rid))
 		return sheet_defs
 
 	def _loadSharedStrings(self):
-		ns = {
-			'': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
-		}
 		doc = self._loadXml('xl/sharedStrings.xml')
 		root = doc.getroot()
+		# Strings are interned so that the many cells (and whatever the caller
+		# builds from them) referring to the same label share one object
+		intern = sys.intern
+		if HAS_LXML:
+			return tuple(intern(''.join(_SI_TEXT_XPATH(si))) for si in _SI_XPATH(root))
 		shared_strings = []
-		for si in root.findall('{%s}si' % ns['']):
-			t = si.find('{%s}t' % ns[''])
+		for si in root.findall(SI_TAG):
+			t = si.find(T_TAG)
 			if t is not None:
-				shared_strings.append(t.text)
-		return shared_strings
+				shared_strings.append(intern(t.text or ''))
+			else:
+				shared_strings.append(intern(''.join(t.text or '' for t in si.findall('%s/%s' % (R_TAG, T_TAG)))))
+		return tuple(shared_strings)
 
 	def _sheetPath(self, index):
-		return 'xl/'+self._rels[self._sheetDefs[index].rid]
+		return 'xl/'+self._getRels()[self._getSheetDefs()[index].rid]
 
 	def _loadXml(self, path):
-		f = self._archive.open(path)
-		return ET.parse(f)
+		with self._openEntry(path) as f:
+			return ET.parse(f)
+
+	def _prefetch(self, paths):
+		# Inflate members in the background, zlib/libdeflate release the GIL
+		names = set(self._archive.namelist())
+		executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+		for path in paths:
+			if path in names:
+				self._prefetched[path] = executor.submit(self._readEntry, path)
+		executor.shutdown(wait=False)
+
+	def _openEntry(self, path):
+		future = self._prefetched.pop(path, None)
+		if future is not None:
+			return io.BytesIO(future.result())
+		if deflate_decompress is not None:
+			return io.BytesIO(self._readEntry(path))
+		# The XML parsers issue many small reads, buffer them in large chunks
+		return io.BufferedReader(self._archive.open(path), buffer_size=XML_READ_BUFFER_SIZE)
+
+	def _readEntry(self, path):
+		# Inflate whole members with libdeflate when available, it is
+		# considerably faster than the streaming zlib decoder in zipfile.
+		if deflate_decompress is not None:
+			info = self._archive.getinfo(path)
+			if info.compress_type == zipfile.ZIP_DEFLATED and not info.flag_bits & 0x1:
+				data = deflate_decompress(self._readRawEntry(info), info.file_size)
+				if zlib.crc32(data) != info.CRC:
+					raise zipfile.BadZipFile('Bad CRC-32 for file %r' % path)
+				return data
+		return self._archive.read(path)
 
-	def _stripNameSpace(self, tag):
-		i = tag.rfind('}')
-		return tag if i < 0 else tag[i+1:]
\ No newline at end of file
+	def _readRawEntry(self, info):
+		# Open the member as if it were stored to get the raw deflate stream
+		raw_info = copy.copy(info)
+		raw_info.compress_type = zipfile.ZIP_STORED
+		raw_info.file_size = info.compress_size
+		del raw_info.CRC
+		with self._archive.open(raw_info) as f:
+			return f.read()
\ No newline at end of file